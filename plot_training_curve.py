@@ -3,7 +3,6 @@ import numpy as np
 from numpy import load
 from pathlib import Path
 import json
-import os
 import matplotlib.pyplot as plt
 
 
@@ -13,19 +12,19 @@ colors = np.array([[0.65, 0.15, 0.15], [0.15, 0.65, 0.15], [0.15, 0.15, 0.65],
 
 
 def load_data(file_path, name, agent_num=0):
-    cast = lambda x: np.array(x)
     with open(file_path) as json_file:
         data = json.load(json_file)
         for key, value in data.items():
             if key.split('/')[-1] == name and int(key.split('/')[-3][-1]) == agent_num:
-                d = cast(value)
-                return d[:, 2]
+                # rows are [wall_time, step, value]; only the value column is plotted
+                return np.fromiter((row[2] for row in value), dtype=np.float64, count=len(value))
 
 
 def plot_data(y, alg_name, color, ax, subsample=10):
-    y = y[:len(y)-(len(y)%subsample)]
-    mean = np.mean(y.reshape(-1, subsample), axis=1)
-    std = np.std(y.reshape(-1, subsample), axis=1)
+    y = y[:len(y)-(len(y)%subsample)].reshape(-1, subsample)
+    mean = y.sum(axis=1) / subsample
+    # variance from the sum of squares, clipped against rounding below zero
+    std = np.sqrt(np.maximum(np.einsum('ij,ij->i', y, y) / subsample - mean ** 2, 0))
     ax.plot(np.arange(mean.shape[0]), mean, color=color, label=alg_name)
     ax.fill_between(np.arange(mean.shape[0]), mean - std, mean + std, color=color, alpha=0.2)
     ax.grid('on')
@@ -43,20 +42,16 @@ def plot_training_curve(config):
     agent_num = 0
     axis = 1
     curve = {}
-    for r, d, f in os.walk(model_path):
-        for file in f:
-            if file.endswith(".json"):
-                algorithm_name = r.split('/')[2]
-                run = r.split('/')[3][-1]
-
-                if algorithm_name not in color_list: continue
-                file_path = os.path.join(r, file)
-                y = load_data(file_path, name=curve_name, agent_num=agent_num)
-                if algorithm_name in curve:
-                    curve[algorithm_name] += y
-                    curve[algorithm_name] /= 2
-                else:
-                    curve[algorithm_name] = y
+    for file_path in sorted(model_path.rglob('*.json')):
+        algorithm_name = file_path.relative_to(model_path).parts[0]
+
+        if algorithm_name not in color_list: continue
+        y = load_data(file_path, name=curve_name, agent_num=agent_num)
+        if algorithm_name in curve:
+            curve[algorithm_name] += y
+            curve[algorithm_name] /= 2
+        else:
+            curve[algorithm_name] = y
 
     for (algorithm_name, y) in curve.items():
         plot_data(y, alg_name=algorithm_name, color=color_list[algorithm_name], ax=ax[axis], subsample=500)
@@ -88,7 +88,7 @@ class Computer(object):
         start_end = [(start, end) for start, end in zip(end_idx, end_idx[1:])]
 
         acs_src = torch.cat(acs_src, dim=1)
-        si = acs_src * prob_plan - acs_src * prob_src
+        si = acs_src * (prob_plan - prob_src)
         result = torch.cat([si[:, start:end] for (start, end) in start_end], dim=0)
         return result
 
@@ -127,8 +127,8 @@ class Trainer(object):
 
         if logger is not None:
             logger.add_scalars('si/losses',
-                               {'trans_loss': trans_loss.detach(),
-                                'i_rews': i_rews.detach()},
+                               {'trans_loss': trans_loss.item(),
+                                'i_rews': i_rews.item()},
                                self.niter)
         self.niter += 1
 
@@ -29,6 +29,19 @@ def hard_update(target, source):
     for target_param, param in zip(target.parameters(), source.parameters()):
         target_param.data.copy_(param.data)
 
+def to_device(module, device):
+    """
+    Move network to device unless its parameters already live there
+    Inputs:
+        module (torch.nn.Module): Net to move
+        device (str): 'gpu' or 'cpu'
+    """
+    target = torch.device('cuda' if device == 'gpu' else 'cpu')
+    # compare device types: parameters on the GPU report an indexed device (cuda:0)
+    if next(module.parameters()).device.type != target.type:
+        module.to(target)
+    return module
+
 # https://github.com/seba-1511/dist_tuto.pth/blob/gh-pages/train_dist.py
 def average_gradients(model):
     """ Gradient averaging. """
@@ -62,34 +75,70 @@ def onehot_from_logits(logits, eps=0.0):
                         enumerate(torch.rand(logits.shape[0]))])
 
 # modified for PyTorch from https://github.com/ericjang/gumbel-softmax/blob/master/Categorical%20VAE.ipynb
-def sample_gumbel(shape, eps=1e-20, tens_type=torch.FloatTensor):
-    """Sample from Gumbel(0, 1)"""
+def sample_gumbel(shape, eps=1e-20, tens_type=torch.FloatTensor, out=None):
+    """Sample from Gumbel(0, 1), in place into out if given"""
+    if out is not None:
+        return out.uniform_().add_(eps).log_().neg_().add_(eps).log_().neg_()
     U = Variable(tens_type(*shape).uniform_(), requires_grad=False)
     return -torch.log(-torch.log(U + eps) + eps)
 
 # modified for PyTorch from https://github.com/ericjang/gumbel-softmax/blob/master/Categorical%20VAE.ipynb
-def gumbel_softmax_sample(logits, temperature, device='cpu'):
+def gumbel_softmax_sample(logits, temperature, device='cpu', noise=None):
     """ Draw a sample from the Gumbel-Softmax distribution"""
-    if device == 'cpu':
+    if noise is not None:
+        y = logits + sample_gumbel(logits.shape, out=noise)
+    elif device == 'cpu':
         y = logits + sample_gumbel(logits.shape, tens_type=type(logits.data))
     else:
         y = logits + sample_gumbel(logits.shape, tens_type=type(logits.data)).cuda()
     return F.softmax(y / temperature, dim=1)
 
 # modified for PyTorch from https://github.com/ericjang/gumbel-softmax/blob/master/Categorical%20VAE.ipynb
-def gumbel_softmax(logits, temperature=1.0, hard=False, device='cpu'):
+def gumbel_softmax(logits, temperature=1.0, hard=False, device='cpu', noise=None):
     """Sample from the Gumbel-Softmax distribution and optionally discretize.
     Args:
       logits: [batch_size, n_class] unnormalized log-probs
       temperature: non-negative scalar
       hard: if True, take argmax, but differentiate w.r.t. soft sample y
+      noise: optional tensor shaped like logits, overwritten with the Gumbel noise
     Returns:
       [batch_size, n_class] sample from the Gumbel-Softmax distribution.
       If hard=True, then the returned sample will be one-hot, otherwise it will
       be a probabilitiy distribution that sums to 1 across classes
     """
-    y = gumbel_softmax_sample(logits, temperature, device)
+    y = gumbel_softmax_sample(logits, temperature, device, noise)
     if hard:
         y_hard = onehot_from_logits(y)
         y = (y_hard - y).detach() + y
     return y
+
+def gumbel_softmax_pair(logits, temperature=1.0, device='cpu', noise=None):
+    """Draw one sample from the Gumbel-Softmax distribution and return it both
+    discretized and soft, so the two share the same Gumbel noise.
+    Args:
+      logits: [batch_size, n_class] unnormalized log-probs
+      temperature: non-negative scalar
+      noise: optional tensor shaped like logits, overwritten with the Gumbel noise
+    Returns:
+      (y_hard, y): one-hot sample differentiated w.r.t. the soft sample, and the
+      soft sample itself (a probability distribution that sums to 1 across classes)
+    """
+    y = gumbel_softmax_sample(logits, temperature, device, noise)
+    y_hard = (onehot_from_logits(y) - y).detach() + y
+    return y_hard, y
+
+
+class NoiseBuffer(object):
+    """
+    Reusable noise tensors for gumbel_softmax, one per logits shape, so that
+    repeated sampling does not allocate a fresh noise tensor every call
+    """
+    def __init__(self):
+        self.buffers = {}
+
+    def like(self, logits):
+        noise = self.buffers.get(logits.shape)
+        if noise is None or noise.device != logits.device:
+            noise = torch.empty_like(logits)
+            self.buffers[logits.shape] = noise
+        return noise
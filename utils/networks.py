@@ -46,15 +46,25 @@ class MLPNetwork(nn.Module):
         else:  # logits for discrete action (will softmax later)
             self.out_fn = lambda x: x
 
-    def forward(self, X):
+    def forward(self, X, n_groups=1):
         """
         Inputs:
             X (PyTorch Matrix): Batch of observations
+            n_groups (int): Number of groups (e.g. agents) interleaved in the batch,
+                            row b * n_groups + i belonging to group i. In training,
+                            input normalization uses each group's own statistics,
+                            as if the network were called once per group
         Outputs:
             out (PyTorch Matrix): Output of network (actions, values, etc)
         """
         X = self.emb(X)
-        h1 = self.nonlin(self.fc1(self.in_fn(X)))
+        if n_groups > 1 and self.training and isinstance(self.in_fn, nn.BatchNorm1d):
+            X = X.view(-1, n_groups, X.shape[-1])
+            X = torch.stack([self.in_fn(X[:, i]) for i in range(n_groups)], dim=1)
+            X = X.view(-1, X.shape[-1])
+        else:
+            X = self.in_fn(X)
+        h1 = self.nonlin(self.fc1(X))
         h2 = self.nonlin(self.fc2(h1))
         out = self.out_fn(self.fc3(h2))
         return out
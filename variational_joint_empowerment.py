@@ -1,16 +1,29 @@
 import numpy as np
 import torch
 from torch.optim import Adam
-from torch.autograd import Variable
 MSELoss = torch.nn.MSELoss()
 
 
 from empowerment import Device
 from variational_empowerment import VariationalBaseEmpowerment
-from utils.misc import gumbel_softmax
+from utils.misc import gumbel_softmax, gumbel_softmax_pair, NoiseBuffer, to_device
 from utils.networks import MLPNetwork
 
 
+def stack_agents(obs):
+    """
+    Rearrange per-environment, per-agent observations into one dense array
+    Inputs:
+        obs (np.ndarray): [n_envs, n_agents] array of observations, either dense
+                          or an object array of per-agent vectors
+    Outputs:
+        obs (np.ndarray): contiguous float32 [n_envs, n_agents, obs_dim] array
+    """
+    if obs.dtype == object:
+        obs = np.stack(obs.ravel()).reshape(obs.shape[:2] + (-1,))
+    return np.ascontiguousarray(obs, dtype=np.float32)
+
+
 class ComputerJoint(object):
     def __init__(self, variational_joint_empowerment):
         self.transition = variational_joint_empowerment.transition
@@ -18,33 +31,29 @@ class ComputerJoint(object):
         self.planning = variational_joint_empowerment.planning
 
         self.device = variational_joint_empowerment.device
+        self.noise = NoiseBuffer()
 
     def compute(self, rewards, next_obs):
         with torch.no_grad():
-            next_obs = [Variable(torch.Tensor(np.vstack(next_obs[:, i])),
-                      requires_grad=False) for i in range(rewards.shape[1])]
+            next_obs = torch.from_numpy(stack_agents(next_obs))
+            # agents share the source and planning networks, so fold them into the batch dimension;
+            # passing n_agents keeps each agent's own batch norm statistics in train mode
+            batch_size, n_agents, n_obs = next_obs.shape
+            no = next_obs.view(batch_size * n_agents, n_obs)
 
-            acs_src = []
-            prob_src = []
-            for no in next_obs:
-                acs_src.append(gumbel_softmax(self.source(no), device=self.device.get_device(), hard=True))
-                prob_src.append(gumbel_softmax(self.source(no), device=self.device.get_device(), hard=False))
+            logits_src = self.source(no, n_agents)
+            acs_src, prob_src = gumbel_softmax_pair(logits_src, device=self.device.get_device(),
+                                                    noise=self.noise.like(logits_src))
 
-            trans_in = torch.cat((*next_obs, *acs_src), dim=1)
+            trans_in = torch.cat((next_obs.view(batch_size, -1), acs_src.view(batch_size, -1)), dim=1)
             trans_out = self.transition(trans_in)
-            prob_plan = []
-            n_obs = len(next_obs[0][0])
-            for i, no in enumerate(next_obs):
-                nno = trans_out[:, i * n_obs:(i + 1) * n_obs]
-                plan_in = torch.cat((no, nno), dim=1)
-                prob_plan.append(gumbel_softmax(self.planning(plan_in), device=self.device.get_device(), hard=False))
-            prob_plan = torch.cat(prob_plan, dim=1)
-            prob_src = torch.cat(prob_src, dim=1)
-            acs_src = torch.cat(acs_src, dim=1)
+            plan_in = torch.cat((no, trans_out.view(batch_size * n_agents, n_obs)), dim=1)
+            logits_plan = self.planning(plan_in, n_agents)
+            prob_plan = gumbel_softmax(logits_plan, device=self.device.get_device(), hard=False,
+                                       noise=self.noise.like(logits_plan))
 
-            E = acs_src * prob_plan - acs_src * prob_src
-            i_rews = E.mean() * torch.ones((1, rewards.shape[1]))
-            return i_rews.numpy()
+            E = acs_src * (prob_plan - prob_src)
+            return np.full((1, rewards.shape[1]), E.mean().item(), dtype=np.float32)
 
 
 class TrainerJoint(object):
@@ -62,54 +71,48 @@ class TrainerJoint(object):
 
     def update(self, sample, logger):
         obs, acs, rews, emps, next_obs, dones = sample
-
+        # agents share the source and planning networks, so fold them into the batch dimension;
+        # passing n_agents keeps each agent's own batch norm statistics in train mode
+        obs = torch.stack(obs, dim=1)
+        acs = torch.stack(acs, dim=1)
+        next_obs = torch.stack(next_obs, dim=1)
+        batch_size, n_agents, n_obs = obs.shape
+        o = obs.view(batch_size * n_agents, n_obs)
+        no = next_obs.view(batch_size * n_agents, n_obs)
+
+        # transition and planning losses share no parameters, so one backward pass
+        # gives each optimizer exactly the gradients of its own loss
         self.transition_optimizer.zero_grad()
-        trans_in = torch.cat((*obs, *acs), dim=1)
+        self.planning_optimizer.zero_grad()
+        trans_in = torch.cat((obs.view(batch_size, -1), acs.view(batch_size, -1)), dim=1)
         next_obs_pred = self.transition(trans_in)
-        trans_loss = MSELoss(next_obs_pred, torch.cat(next_obs, dim=1))
-        trans_loss.backward()
-        self.transition_optimizer.step()
+        trans_loss = MSELoss(next_obs_pred, next_obs.view(batch_size, -1))
 
-        self.planning_optimizer.zero_grad()
-        acs_plan = []
-        for o, no in zip(obs, next_obs):
-            plan_in = torch.cat((o, no), dim=1)
-            acs_plan.append(gumbel_softmax(self.planning(plan_in), device=self.device.get_device(), hard=True))
-        acs_plan = torch.cat(acs_plan, dim=1)
-        acs_torch = torch.cat(acs, dim=1)
-        plan_loss = MSELoss(acs_plan, acs_torch)
-        plan_loss.backward()
+        plan_in = torch.cat((o, no), dim=1)
+        acs_plan = gumbel_softmax(self.planning(plan_in, n_agents), device=self.device.get_device(), hard=True)
+        plan_loss = MSELoss(acs_plan, acs.view(batch_size * n_agents, -1))
+        (trans_loss + plan_loss).backward()
+        self.transition_optimizer.step()
         self.planning_optimizer.step()
 
         self.source_optimizer.zero_grad()
-        acs_src = []
-        prob_src = []
-        for no in next_obs:
-            acs_src.append(gumbel_softmax(self.source(no), device=self.device.get_device(), hard=True))
-            prob_src.append(gumbel_softmax(self.source(no), device=self.device.get_device(), hard=False))
+        acs_src, prob_src = gumbel_softmax_pair(self.source(no, n_agents), device=self.device.get_device())
         with torch.no_grad():
-            trans_in = torch.cat((*next_obs, *acs_src), dim=1)
+            trans_in = torch.cat((next_obs.view(batch_size, -1), acs_src.view(batch_size, -1)), dim=1)
             trans_out = self.transition(trans_in)
-        prob_plan = []
-        n_obs = len(next_obs[0][0])
-        for i, no in enumerate(next_obs):
-            nno = trans_out[:, i * n_obs:(i + 1) * n_obs]
-            plan_in = torch.cat((no, nno), dim=1)
-            prob_plan.append(gumbel_softmax(self.planning(plan_in), device=self.device.get_device(), hard=False))
-        prob_plan = torch.cat(prob_plan, dim=1)
-        prob_src = torch.cat(prob_src, dim=1)
-        acs_src = torch.cat(acs_src, dim=1)
-
-        E = acs_src * prob_plan - acs_src * prob_src
+        plan_in = torch.cat((no, trans_out.view(batch_size * n_agents, n_obs)), dim=1)
+        prob_plan = gumbel_softmax(self.planning(plan_in, n_agents), device=self.device.get_device(), hard=False)
+
+        E = acs_src * (prob_plan - prob_src)
         i_rews = -E.mean()
         i_rews.backward()
         self.source_optimizer.step()
 
         if logger is not None:
             logger.add_scalars('empowerment/losses',
-                               {'trans_loss': trans_loss.detach(),
-                                'plan_loss': plan_loss.detach(),
-                                'i_rews': i_rews.detach()},
+                               {'trans_loss': trans_loss.item(),
+                                'plan_loss': plan_loss.item(),
+                                'i_rews': i_rews.item()},
                                self.niter)
         self.niter += 1
 
@@ -138,14 +141,9 @@ class VariationalJointEmpowerment(VariationalBaseEmpowerment):
         self.source.train()
         self.planning.train()
 
-        if device == 'gpu':
-            fn = lambda x: x.cuda()
-        else:
-            fn = lambda x: x.cpu()
-        if not self.device.get_device() == device:
-            self.transition = fn(self.transition)
-            self.source = fn(self.source)
-            self.planning = fn(self.planning)
+        to_device(self.transition, device)
+        to_device(self.source, device)
+        to_device(self.planning, device)
 
         self.device.set_device(device)
 
@@ -154,15 +152,9 @@ class VariationalJointEmpowerment(VariationalBaseEmpowerment):
         self.source.eval()
         self.planning.eval()
 
-        if device == 'gpu':
-            fn = lambda x: x.cuda()
-        else:
-            fn = lambda x: x.cpu()
-        # only need main policy for rollouts
-        if not self.device.get_device() == device:
-            self.transition = fn(self.transition)
-            self.source = fn(self.source)
-            self.planning = fn(self.planning)
+        to_device(self.transition, device)
+        to_device(self.source, device)
+        to_device(self.planning, device)
 
         self.device.set_device(device)
 
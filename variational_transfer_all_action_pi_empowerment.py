@@ -6,7 +6,7 @@ MSELoss = torch.nn.MSELoss()
 
 
 from variational_empowerment import VariationalBaseEmpowerment
-from utils.misc import gumbel_softmax
+from utils.misc import gumbel_softmax, to_device
 from utils.networks import MLPNetwork
 from empowerment import Device
 
@@ -46,7 +46,7 @@ class ComputerTransferAllActionPi(object):
         prob_src = torch.cat(prob_src, dim=1)
         acs_src = torch.cat(acs_src, dim=1)
 
-        return acs_src * prob_plan - acs_src * prob_src
+        return acs_src * (prob_plan - prob_src)
 
 
 class TrainerTransferAllActionPi(object):
@@ -85,8 +85,8 @@ class TrainerTransferAllActionPi(object):
 
         if logger is not None:
             logger.add_scalars('empowerment/losses',
-                               {'trans_loss': trans_loss.detach(),
-                                'i_rews': i_rews.detach()},
+                               {'trans_loss': trans_loss.item(),
+                                'i_rews': i_rews.item()},
                                self.niter)
         self.niter += 1
 
@@ -110,8 +110,7 @@ class VariationalTransferAllActionPiEmpowerment(VariationalBaseEmpowerment):
         next_obs = [Variable(torch.Tensor(np.vstack(next_obs[:, i])),
                              requires_grad=False) for i in range(next_obs.shape[1])]
         E = self.computer.compute(next_obs)
-        i_rews = E.mean() * torch.ones((1, rewards.shape[1]))
-        return i_rews.detach().numpy()
+        return np.full((1, rewards.shape[1]), E.mean().item(), dtype=np.float32)
 
     def update(self, sample, logger=None):
         self.trainer.update(sample, logger)
@@ -123,16 +122,11 @@ class VariationalTransferAllActionPiEmpowerment(VariationalBaseEmpowerment):
         for planning in self.planning:
             planning.train()
 
-        if device == 'gpu':
-            fn = lambda x: x.cuda()
-        else:
-            fn = lambda x: x.cpu()
-        if not self.device.get_device() == device:
-            self.transition = fn(self.transition)
-            for source in self.source:
-                source = fn(source)
-            for planning in self.planning:
-                planning = fn(planning)
+        to_device(self.transition, device)
+        for source in self.source:
+            to_device(source, device)
+        for planning in self.planning:
+            to_device(planning, device)
 
         self.device.set_device(device)
 
@@ -143,17 +137,11 @@ class VariationalTransferAllActionPiEmpowerment(VariationalBaseEmpowerment):
         for source in self.source:
             source.eval()
 
-        if device == 'gpu':
-            fn = lambda x: x.cuda()
-        else:
-            fn = lambda x: x.cpu()
-        # only need main policy for rollouts
-        if not self.device.get_device() == device:
-            self.transition = fn(self.transition)
-            for source in self.source:
-                source = fn(source)
-            for planning in self.planning:
-                planning = fn(planning)
+        to_device(self.transition, device)
+        for source in self.source:
+            to_device(source, device)
+        for planning in self.planning:
+            to_device(planning, device)
 
         self.device.set_device(device)
 
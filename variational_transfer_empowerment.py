@@ -1,12 +1,11 @@
 import numpy as np
 import torch
 from torch.optim import Adam
-from torch.autograd import Variable
 MSELoss = torch.nn.MSELoss()
 
 
 from variational_empowerment import VariationalBaseEmpowerment
-from utils.misc import gumbel_softmax
+from utils.misc import gumbel_softmax, gumbel_softmax_pair, NoiseBuffer, to_device
 from utils.networks import MLPNetwork
 
 
@@ -18,58 +17,48 @@ class ComputerTransfer(object):
         self.plan_dev = empowerment.plan_dev
         self.source_dev = empowerment.source_dev
         self.trans_dev = empowerment.trans_dev
+        self.obs_dims = empowerment.obs_dims
+        self.noise = NoiseBuffer()
 
     def compute(self, rewards, next_obs):
         with torch.no_grad():
-            next_obs = [Variable(torch.Tensor(np.vstack(next_obs[:, i])),
-                      requires_grad=False) for i in range(rewards.shape[1])]
+            next_obs = [torch.from_numpy(np.vstack(next_obs[:, i]).astype(np.float32, copy=False))
+                        for i in range(rewards.shape[1])]
 
             acs_src = []
             prob_src = []
             for no, source in zip(next_obs, self.source):
-                acs_src.append(gumbel_softmax(source(no), device=self.source_dev, hard=True))
-                prob_src.append(gumbel_softmax(source(no), device=self.source_dev, hard=False))
+                logits_src = source(no)
+                ac_src, pr_src = gumbel_softmax_pair(logits_src, device=self.source_dev,
+                                                     noise=self.noise.like(logits_src))
+                acs_src.append(ac_src)
+                prob_src.append(pr_src)
 
             trans_in = torch.cat((*next_obs, *acs_src), dim=1)
             trans_out = self.transition(trans_in)
+            nnos = torch.split(trans_out, self.obs_dims, dim=1)
             prob_plan = []
-            start = 0
-            for i, (no, planning) in enumerate(zip(next_obs, self.planning)):
-                length = no.shape[1]
-                nno = trans_out[:, start:start + length]
+            for no, nno, planning in zip(next_obs, nnos, self.planning):
                 plan_in = torch.cat((no, nno), dim=1)
-                prob_plan.append(gumbel_softmax(planning(plan_in), device=self.plan_dev, hard=False))
+                logits_plan = planning(plan_in)
+                prob_plan.append(gumbel_softmax(logits_plan, device=self.plan_dev, hard=False,
+                                                noise=self.noise.like(logits_plan)))
             prob_plan = torch.cat(prob_plan, dim=1)
             prob_src = torch.cat(prob_src, dim=1)
             acs_src = torch.cat(acs_src, dim=1)
 
-            E = acs_src * prob_plan - acs_src * prob_src
-            i_rews = E.mean() * torch.ones((1, rewards.shape[1]))
-            return i_rews.numpy()
+            E = acs_src * (prob_plan - prob_src)
+            return np.full((1, rewards.shape[1]), E.mean().item(), dtype=np.float32)
 
     def prep_rollouts(self, device='cpu'):
-        self.transition.eval()
-        if device == 'gpu':
-            fn = lambda x: x.cuda()
-        else:
-            fn = lambda x: x.cpu()
-        # only need main policy for rollouts
-        if not self.trans_dev == device:
-            self.transition = fn(self.transition)
-            self.trans_dev = device
-        self.transition.eval()
-        if not self.source_dev == device:
-            for source in self.source:
-                source = fn(source)
-            self.source_dev = device
+        to_device(self.transition, device).eval()
+        self.trans_dev = device
         for source in self.source:
-            source.eval()
-        if not self.plan_dev == device:
-            for planning in self.planning:
-                planning = fn(planning)
-            self.plan_dev = device
+            to_device(source, device).eval()
+        self.source_dev = device
         for planning in self.planning:
-            planning.eval()
+            to_device(planning, device).eval()
+        self.plan_dev = device
 
     def prepare_training(self, device):
         self.trans_dev = device
@@ -85,6 +74,7 @@ class TrainerTransfer(object):
         self.plan_dev = empowerment.plan_dev
         self.source_dev = empowerment.source_dev
         self.trans_dev = empowerment.trans_dev
+        self.obs_dims = empowerment.obs_dims
 
         self.transition_optimizer = Adam(self.transition.parameters(), lr=empowerment.lr)
         params_planning = []
@@ -98,14 +88,14 @@ class TrainerTransfer(object):
     def update(self, sample, logger):
         obs, acs, rews, emps, next_obs, dones = sample
 
+        # transition and planning losses share no parameters, so one backward pass
+        # gives each optimizer exactly the gradients of its own loss
         self.transition_optimizer.zero_grad()
+        self.planning_optimizer.zero_grad()
         trans_in = torch.cat((*obs, *acs), dim=1)
         next_obs_pred = self.transition(trans_in)
         trans_loss = MSELoss(next_obs_pred, torch.cat(next_obs, dim=1))
-        trans_loss.backward()
-        self.transition_optimizer.step()
 
-        self.planning_optimizer.zero_grad()
         acs_plan = []
         for o, no, planning in zip(obs, next_obs, self.planning):
             plan_in = torch.cat((o, no), dim=1)
@@ -113,62 +103,51 @@ class TrainerTransfer(object):
         acs_plan = torch.cat(acs_plan, dim=1)
         acs_torch = torch.cat(acs, dim=1)
         plan_loss = MSELoss(acs_plan, acs_torch)
-        plan_loss.backward()
+        (trans_loss + plan_loss).backward()
+        self.transition_optimizer.step()
         self.planning_optimizer.step()
 
         self.source_optimizer.zero_grad()
         acs_src = []
         prob_src = []
         for no, source in zip(next_obs, self.source):
-            acs_src.append(gumbel_softmax(source(no), device=self.source_dev, hard=True))
-            prob_src.append(gumbel_softmax(source(no), device=self.source_dev, hard=False))
+            ac_src, pr_src = gumbel_softmax_pair(source(no), device=self.source_dev)
+            acs_src.append(ac_src)
+            prob_src.append(pr_src)
         with torch.no_grad():
             trans_in = torch.cat((*next_obs, *acs_src), dim=1)
             trans_out = self.transition(trans_in)
+        nnos = torch.split(trans_out, self.obs_dims, dim=1)
         prob_plan = []
-        start = 0
-        for i, (no, planning) in enumerate(zip(next_obs, self.planning)):
-            length = no.shape[1]
-            nno = trans_out[:, start:start + length]
+        for no, nno, planning in zip(next_obs, nnos, self.planning):
             plan_in = torch.cat((no, nno), dim=1)
             prob_plan.append(gumbel_softmax(planning(plan_in), device=self.plan_dev, hard=False))
-            start += length
         prob_plan = torch.cat(prob_plan, dim=1)
         prob_src = torch.cat(prob_src, dim=1)
         acs_src = torch.cat(acs_src, dim=1)
 
-        E = acs_src * prob_plan - acs_src * prob_src
+        E = acs_src * (prob_plan - prob_src)
         i_rews = -E.mean()
         i_rews.backward()
         self.source_optimizer.step()
 
         if logger is not None:
             logger.add_scalars('empowerment/losses',
-                               {'trans_loss': trans_loss.detach(),
-                                'plan_loss': plan_loss.detach(),
-                                'i_rews': i_rews.detach()},
+                               {'trans_loss': trans_loss.item(),
+                                'plan_loss': plan_loss.item(),
+                                'i_rews': i_rews.item()},
                                self.niter)
         self.niter += 1
 
     def prepare_training(self, device):
-        self.transition.train()
-        if device == 'gpu':
-            fn = lambda x: x.cuda()
-        else:
-            fn = lambda x: x.cpu()
-        if not self.trans_dev == device:
-            self.transition = fn(self.transition)
-            self.trans_dev = device
-        if not self.source_dev == device:
-            for source in self.source:
-                source = fn(source)
-                source.train()
-            self.source_dev = device
-        if not self.plan_dev == device:
-            for planning in self.planning:
-                planning = fn(planning)
-                planning.train()
-            self.plan_dev = device
+        to_device(self.transition, device).train()
+        self.trans_dev = device
+        for source in self.source:
+            to_device(source, device).train()
+        self.source_dev = device
+        for planning in self.planning:
+            to_device(planning, device).train()
+        self.plan_dev = device
 
     def prep_rollouts(self, device='cpu'):
         self.trans_dev = device
@@ -183,6 +162,8 @@ class VariationalTransferEmpowerment(VariationalBaseEmpowerment):
         self.transition = MLPNetwork(num_in_trans, num_out_trans, recurrent=True)
         self.source = [MLPNetwork(p['num_in_src'], p['num_out_src'], recurrent=True) for p in init_params]
         self.planning = [MLPNetwork(p['num_in_plan'], p['num_out_plan'], recurrent=True) for p in init_params]
+        # per-agent widths of the joint observation predicted by the transition
+        self.obs_dims = [p['num_in_src'] for p in init_params]
 
         self.lr = lr
 
@@ -202,11 +183,10 @@ class VariationalTransferEmpowerment(VariationalBaseEmpowerment):
     def prep_training(self, device='gpu'):
         self.computer.prepare_training(device)
         self.trainer.prepare_training(device)
-        self.transition.train()
 
     def prep_rollouts(self, device='cpu'):
-        self.computer.prep_rollouts()
-        self.trainer.prep_rollouts()
+        self.computer.prep_rollouts(device)
+        self.trainer.prep_rollouts(device)
 
     @classmethod
     def init_from_env(cls, env, lr=0.01, hidden_dim=64, recurrent=False, convolutional=False):
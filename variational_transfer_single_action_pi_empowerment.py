@@ -6,7 +6,7 @@ MSELoss = torch.nn.MSELoss()
 
 
 from variational_empowerment import VariationalBaseEmpowerment
-from utils.misc import gumbel_softmax
+from utils.misc import gumbel_softmax, to_device
 from utils.networks import MLPNetwork
 
 
@@ -18,6 +18,7 @@ class ComputerTransferSingleActionPi(object):
         self.plan_dev = empowerment.plan_dev
         self.source_dev = empowerment.source_dev
         self.trans_dev = empowerment.trans_dev
+        self.obs_dims = empowerment.obs_dims
         self.agents = empowerment.agents
 
     def compute(self, rewards, next_obs):
@@ -33,11 +34,9 @@ class ComputerTransferSingleActionPi(object):
 
             trans_in = torch.cat((*next_obs, *acs_src), dim=1)
             trans_out = self.transition(trans_in)
+            nnos = torch.split(trans_out, self.obs_dims, dim=1)
             prob_plan = []
-            start = 0
-            for i, (no, planning) in enumerate(zip(next_obs, self.planning)):
-                length = no.shape[1]
-                nno = trans_out[:, start:start + length]
+            for i, (no, nno, planning) in enumerate(zip(next_obs, nnos, self.planning)):
                 acs_pi = gumbel_softmax(self.agents[i].policy(nno), device=self.source_dev, hard=True)
                 plan_in = torch.cat((no, nno, acs_pi), dim=1)
 
@@ -46,33 +45,18 @@ class ComputerTransferSingleActionPi(object):
             prob_src = torch.cat(prob_src, dim=1)
             acs_src = torch.cat(acs_src, dim=1)
 
-            E = acs_src * prob_plan - acs_src * prob_src
-            i_rews = E.mean() * torch.ones((1, rewards.shape[1]))
-            return i_rews.numpy()
+            E = acs_src * (prob_plan - prob_src)
+            return np.full((1, rewards.shape[1]), E.mean().item(), dtype=np.float32)
 
     def prep_rollouts(self, device='cpu'):
-        self.transition.eval()
-        if device == 'gpu':
-            fn = lambda x: x.cuda()
-        else:
-            fn = lambda x: x.cpu()
-        # only need main policy for rollouts
-        if not self.trans_dev == device:
-            self.transition = fn(self.transition)
-            self.trans_dev = device
-        self.transition.eval()
-        if not self.source_dev == device:
-            for source in self.source:
-                source = fn(source)
-            self.source_dev = device
+        to_device(self.transition, device).eval()
+        self.trans_dev = device
         for source in self.source:
-            source.eval()
-        if not self.plan_dev == device:
-            for planning in self.planning:
-                planning = fn(planning)
-            self.plan_dev = device
+            to_device(source, device).eval()
+        self.source_dev = device
         for planning in self.planning:
-            planning.eval()
+            to_device(planning, device).eval()
+        self.plan_dev = device
 
     def prepare_training(self, device):
         self.trans_dev = device
@@ -88,6 +72,7 @@ class TrainerTransferSingleActionPi(object):
         self.plan_dev = empowerment.plan_dev
         self.source_dev = empowerment.source_dev
         self.trans_dev = empowerment.trans_dev
+        self.obs_dims = empowerment.obs_dims
         self.agents = empowerment.agents
 
         self.transition_optimizer = Adam(self.transition.parameters(), lr=empowerment.lr)
@@ -122,50 +107,37 @@ class TrainerTransferSingleActionPi(object):
         with torch.no_grad():
             trans_in = torch.cat((*next_obs, *acs_src), dim=1)
             trans_out = self.transition(trans_in)
+        nnos = torch.split(trans_out, self.obs_dims, dim=1)
         prob_plan = []
-        start = 0
-        for i, (no, planning) in enumerate(zip(next_obs, self.planning)):
-            length = no.shape[1]
-            nno = trans_out[:, start:start + length]
+        for i, (no, nno, planning) in enumerate(zip(next_obs, nnos, self.planning)):
             acs_pi = gumbel_softmax(self.agents[i].policy(nno), device=self.source_dev, hard=True)
             plan_in = torch.cat((no, nno, acs_pi), dim=1)
             prob_plan.append(gumbel_softmax(planning(plan_in), device=self.plan_dev, hard=False))
-            start += length
         prob_plan = torch.cat(prob_plan, dim=1)
         prob_src = torch.cat(prob_src, dim=1)
         acs_src = torch.cat(acs_src, dim=1)
 
-        E = acs_src * prob_plan - acs_src * prob_src
+        E = acs_src * (prob_plan - prob_src)
         i_rews = -E.mean()
         i_rews.backward()
         self.source_optimizer.step()
 
         if logger is not None:
             logger.add_scalars('empowerment/losses',
-                               {'trans_loss': trans_loss.detach(),
-                                'i_rews': i_rews.detach()},
+                               {'trans_loss': trans_loss.item(),
+                                'i_rews': i_rews.item()},
                                self.niter)
         self.niter += 1
 
     def prepare_training(self, device):
-        self.transition.train()
-        if device == 'gpu':
-            fn = lambda x: x.cuda()
-        else:
-            fn = lambda x: x.cpu()
-        if not self.trans_dev == device:
-            self.transition = fn(self.transition)
-            self.trans_dev = device
-        if not self.source_dev == device:
-            for source in self.source:
-                source = fn(source)
-                source.train()
-            self.source_dev = device
-        if not self.plan_dev == device:
-            for planning in self.planning:
-                planning = fn(planning)
-                planning.train()
-            self.plan_dev = device
+        to_device(self.transition, device).train()
+        self.trans_dev = device
+        for source in self.source:
+            to_device(source, device).train()
+        self.source_dev = device
+        for planning in self.planning:
+            to_device(planning, device).train()
+        self.plan_dev = device
 
     def prep_rollouts(self, device='cpu'):
         self.trans_dev = device
@@ -181,6 +153,8 @@ class VariationalTransferSingleActionPiEmpowerment(VariationalBaseEmpowerment):
         self.transition = MLPNetwork(num_in_trans, num_out_trans, recurrent=True)
         self.source = [MLPNetwork(p['num_in_src'], p['num_out_src'], recurrent=True) for p in init_params]
         self.planning = [MLPNetwork(p['num_in_plan'], p['num_out_plan'], recurrent=True) for p in init_params]
+        # per-agent widths of the joint observation predicted by the transition
+        self.obs_dims = [p['num_in_src'] for p in init_params]
 
         self.lr = lr
 
@@ -200,11 +174,10 @@ class VariationalTransferSingleActionPiEmpowerment(VariationalBaseEmpowerment):
     def prep_training(self, device='gpu'):
         self.computer.prepare_training(device)
         self.trainer.prepare_training(device)
-        self.transition.train()
 
     def prep_rollouts(self, device='cpu'):
-        self.computer.prep_rollouts()
-        self.trainer.prep_rollouts()
+        self.computer.prep_rollouts(device)
+        self.trainer.prep_rollouts(device)
 
     @classmethod
     def init(cls, agents, env, lr=0.01, hidden_dim=64, recurrent=False, convolutional=False):